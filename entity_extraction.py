@@ -4,62 +4,358 @@ Product Data Extraction and Attribute Annotation System
 This module provides functionality to extract product and care attributes
 from product descriptions and care instructions using the Mistral AI API.
 It processes JSON input files containing product data and outputs structured
- JSON with extracted attributes.
+ JSON Lines with extracted attributes.
 
 Features:
-- Batch processing of product data from JSON files
+- Concurrent processing of product data from JSON files (asyncio)
+- Several products extracted per API call to amortise prompt and latency
+- Model cascade: a small model first, escalating to a larger one when its
+  output fails validation or leaves too many attributes "Not Available"
 - Automatic retry logic for API failures
 - Error handling for various API response scenarios
-- JSON validation and fallback handling
+- JSON validation against Pydantic schemas, with self-repair retries
 - Rate limiting protection with exponential backoff
+- Adaptive token-bucket rate limiting that backs off on 429s and honours
+  Retry-After
+- Product and care attributes extracted and cached independently per field
+- Persistent response cache so unchanged fields never hit the API twice
+- Optional semantic cache that reuses results for near-duplicate descriptions
+- Structural cache that reuses attributes for fields with the same skeleton
+- Streaming JSONL output with resume of interrupted runs
+- Duplicate input rows extracted once and fanned out
+- Flattened CSV export of the results, one column per attribute
+- Live progress bar with throughput and ETA; warnings go through logging
 
 Dependencies:
 - mistralai: Official Mistral AI Python client
 - json: Built-in JSON handling
-- time: Built-in time utilities for delays
+- asyncio: Built-in concurrency for overlapping API requests
+- random: Built-in jitter for retry backoff delays
+- csv: Built-in writer for the flattened CSV export
+- hashlib / shelve: Built-in hashing and on-disk storage for the response cache
+- html / unicodedata: Built-in text canonicalisation for cache keys
+- httpx[http2]: Shared HTTP/2 connection pool used by the Mistral client
+- pydantic: Validation of the attributes returned by the model
+- tqdm: Progress bar over the completed batches
+- logging: Built-in reporting of retries and failed responses
+- sentence-transformers / faiss (optional): Embeddings and vector search for
+  the semantic cache
+
+Run as a script to process ``hm_input.json``. When imported, the client and
+caches are opened on first use; call ``close_resources()`` when done.
+
+Configuration (environment variables):
+- MISTRAL_API_KEY: API key used to authenticate with Mistral AI (required;
+  never hardcode it)
+- MISTRAL_MAX_QPS: Ceiling on requests per second sent to the API (default: 5)
+- MISTRAL_CONCURRENCY: Maximum number of API requests in flight, and of
+  batches being processed (default: 10)
+- MISTRAL_BATCH_SIZE: Number of products extracted per API call (default: 5)
+- MISTRAL_SEMANTIC_CACHE: Set to "1" to enable the semantic cache (default: off)
+- MISTRAL_MODELS: Comma-separated model cascade, smallest first
+  (default: "ministral-3b-latest,open-mistral-7b")
 
 """
+import asyncio
+import csv
+import email.utils
+import hashlib
+import html
 import json
+import logging
+import random
+import re
+import shelve
 import time
+import unicodedata
+import httpx
 from mistralai import Mistral
+from mistralai.models import NoResponseError
+from pydantic import BaseModel, ConfigDict, Field, ValidationError, field_validator
+from tqdm.asyncio import tqdm as atqdm
+from tqdm.contrib.logging import logging_redirect_tqdm
 from dotenv import load_dotenv
 import os
 
+try:
+    import faiss
+    from sentence_transformers import SentenceTransformer
+except ImportError:  # optional: only needed for the semantic cache
+    faiss = SentenceTransformer = None
+
+logger = logging.getLogger(__name__)
+
 # ✅ Load environment variables
 load_dotenv()
 api_key = os.getenv("MISTRAL_API_KEY")
 
-# ✅ Initialize Mistral client
-client = Mistral(api_key=api_key)
+# ✅ Shared HTTP/2 connection pool, reused by every request of the run
+HTTP_POOL_SIZE = 64
+HTTP_TIMEOUT = 30
+_http_client = None
+_client = None
+
+
+def get_client():
+    """
+    Return the Mistral client shared by every request of the process.
+
+    The client and its HTTP/2 connection pool are created on first use, so
+    importing this module opens no connections; ``close_resources`` closes
+    the pool and the next call creates a fresh one.
+
+    Returns:
+        Mistral: Client authenticated with ``MISTRAL_API_KEY``.
+    """
+    global _http_client, _client
+    if _client is None:
+        _http_client = httpx.AsyncClient(
+            http2=True,
+            limits=httpx.Limits(
+                max_connections=HTTP_POOL_SIZE, max_keepalive_connections=HTTP_POOL_SIZE
+            ),
+            timeout=HTTP_TIMEOUT,
+        )
+        _client = Mistral(api_key=api_key, async_client=_http_client)
+    return _client
+
+# ✅ Model cascade used for extraction, smallest (cheapest) first
+MODELS = [
+    model.strip()
+    for model in os.getenv("MISTRAL_MODELS", "ministral-3b-latest,open-mistral-7b").split(",")
+    if model.strip()
+]
+
+# ✅ Escalate to the next model when fewer attributes than this are filled
+MIN_FILLED_FRACTION = 0.2
+
+# ✅ Persistent cache of extracted attributes, keyed by request content
+CACHE_PATH = "mistral_cache"
+_cache = None
+
+
+def get_cache():
+    """
+    Return the persistent response cache, opening ``CACHE_PATH`` on first use.
+
+    Returns:
+        shelve.Shelf: Attributes keyed by ``get_cache_key`` / ``get_slot_key``.
+    """
+    global _cache
+    if _cache is None:
+        _cache = shelve.open(CACHE_PATH)
+    return _cache
+
+# ✅ Semantic cache settings
+SEMANTIC_CACHE_ENABLED = os.getenv("MISTRAL_SEMANTIC_CACHE") == "1"
+SEMANTIC_MODEL = "all-MiniLM-L6-v2"
+SEMANTIC_THRESHOLD = 0.92
+SEMANTIC_CANDIDATES = 5
+
+# ✅ Colour words masked out of description skeletons in the structural cache
+COLOUR_WORDS = {
+    "beige", "black", "blue", "brown", "burgundy", "cream", "green", "grey",
+    "khaki", "lilac", "navy", "orange", "pink", "purple", "red", "turquoise",
+    "white", "yellow",
+}
+
+# ✅ Garment nouns that must agree before a semantic cache hit is trusted
+PRODUCT_NOUNS = {
+    "blouse", "bodysuit", "bra", "bralette", "camisole", "cardigan", "dress",
+    "hoodie", "jacket", "jumpsuit", "shirt", "shorts", "skirt", "sweater",
+    "sweatshirt", "t-shirt", "tank", "tee", "top", "trousers", "tunic", "vest",
+}
+
+# ✅ Throughput limits: requests per second and requests in flight
+MAX_QPS = float(os.getenv("MISTRAL_MAX_QPS", "5"))
+MIN_QPS = 0.2
+MAX_CONCURRENCY = int(os.getenv("MISTRAL_CONCURRENCY", "10"))
+
+# ✅ Adaptive rate limiting: shrink on 429 bursts, grow back on sustained success
+RATE_DECREASE_FACTOR = 0.5
+RATE_INCREASE_STEP = 0.1  # fraction of MAX_QPS added per adjustment interval
+RATE_ADJUST_INTERVAL = 5  # seconds
+
+# ✅ Number of products packed into a single API call
+BATCH_SIZE = int(os.getenv("MISTRAL_BATCH_SIZE", "5"))
+
+# ✅ Retry policy: attempts per entry and the cap on a single backoff delay
+MAX_ATTEMPTS = 3
+MAX_BACKOFF = 32
+
+# ✅ Requests per field when the response fails JSON or schema validation
+MAX_PARSE_ATTEMPTS = 2
+
+# ✅ JSON input: a list of product objects
+INPUT_PATH = "hm_input.json"
+
+# ✅ JSONL output: one result per line, appended as batches complete
+OUTPUT_PATH = "hm_output.jsonl"
+
+# ✅ Flattened copy of the JSONL output, written once the run completes
+CSV_OUTPUT_PATH = "hm_output.csv"
+
+# ✅ Attribute groups returned by the model
+PRODUCT_ATTRIBUTES = [
+    "Product Type",
+    "Support/Wiring",
+    "Closures",
+    "Neckline design",
+    "Waist Style",
+    "Design Features",
+    "Intended Use / Function",
+    "Length",
+]
+CARE_ATTRIBUTES = [
+    "Washing Instructions",
+    "Drying Method",
+    "Bleach Instructions",
+    "Dry Cleaning",
+    "Ironing Instructions",
+]
+
+# ✅ Validated schemas of the attribute groups
+NOT_AVAILABLE_VALUES = {"", "not available", "n/a"}
+
+
+class AttributeGroup(BaseModel):
+    """Attribute group whose unfilled values all read "Not Available"."""
+
+    model_config = ConfigDict(populate_by_name=True)
+
+    @field_validator("*")
+    @classmethod
+    def normalise_missing(cls, value):
+        """Map blanks and "N/A"-style placeholders to "Not Available"."""
+        value = value.strip()
+        return "Not Available" if value.lower() in NOT_AVAILABLE_VALUES else value
+
+
+class ProductAttributes(AttributeGroup):
+    """Product attributes extracted from a product description."""
+
+    product_type: str = Field("Not Available", alias="Product Type")
+    support_wiring: str = Field("Not Available", alias="Support/Wiring")
+    closures: str = Field("Not Available", alias="Closures")
+    neckline_design: str = Field("Not Available", alias="Neckline design")
+    waist_style: str = Field("Not Available", alias="Waist Style")
+    design_features: str = Field("Not Available", alias="Design Features")
+    intended_use: str = Field("Not Available", alias="Intended Use / Function")
+    length: str = Field("Not Available", alias="Length")
+
+
+class CareAttributes(AttributeGroup):
+    """Care attributes extracted from care instructions."""
+
+    washing_instructions: str = Field("Not Available", alias="Washing Instructions")
+    drying_method: str = Field("Not Available", alias="Drying Method")
+    bleach_instructions: str = Field("Not Available", alias="Bleach Instructions")
+    dry_cleaning: str = Field("Not Available", alias="Dry Cleaning")
+    ironing_instructions: str = Field("Not Available", alias="Ironing Instructions")
+
+# ✅ Input fields and the attribute group extracted from each
+ATTRIBUTE_MODELS = {
+    "description": ProductAttributes,
+    "care_instructions": CareAttributes,
+}
+FIELD_GROUPS = {
+    "description": ("Product Attributes", PRODUCT_ATTRIBUTES),
+    "care_instructions": ("Care Attributes", CARE_ATTRIBUTES),
+}
+
+# ✅ Output schemas (empty values keep them short)
+PRODUCT_SCHEMA = {name: "" for name in PRODUCT_ATTRIBUTES}
+CARE_SCHEMA = {name: "" for name in CARE_ATTRIBUTES}
+NOT_AVAILABLE_RULE = '. Use "Not Available" unless a value is stated or strongly implied.'
+
+def compact_json(value):
+    """Serialise a value as JSON without optional whitespace."""
+    return json.dumps(value, separators=(",", ":"))
 
-# ✅ Load JSON input
-with open("hm_input.json", "r", encoding="utf-8") as f:
-    input_data = json.load(f)  # should be a list of objects
+# ✅ System prompts: invariant instructions, sent first so providers can reuse the prefix
+SYSTEM_PROMPTS = {
+    "description": (
+        "Extract product attributes from the product description. "
+        "Return only JSON matching " + compact_json(PRODUCT_SCHEMA) + NOT_AVAILABLE_RULE
+    ),
+    "care_instructions": (
+        "Extract care attributes from the care instructions. "
+        "Return only JSON matching " + compact_json(CARE_SCHEMA) + NOT_AVAILABLE_RULE
+    ),
+}
+
+# ✅ Prompt templates: the variable field, sent last as the user message
+PROMPT_TEMPLATES = {
+    "description": "Description: {text}",
+    "care_instructions": "Care instructions: {text}",
+}
+
+# ✅ Appended to the user message when a response fails validation
+REPAIR_TEMPLATE = (
+    "\n\nYour previous output failed validation: {problem}. "
+    "Return valid JSON matching the schema."
+)
+
+# ✅ Batch prompts: the same instructions applied to an enumerated list of inputs
+BATCH_SYSTEM_PROMPTS = {
+    "description": (
+        "Extract product attributes from each numbered product description. "
+        'Return only a JSON object {"results":[...]} with one item per '
+        "description, in order, each matching "
+        + compact_json({"index": 1, **PRODUCT_SCHEMA}) + NOT_AVAILABLE_RULE
+    ),
+    "care_instructions": (
+        "Extract care attributes from each numbered set of care instructions. "
+        'Return only a JSON object {"results":[...]} with one item per set, '
+        "in order, each matching "
+        + compact_json({"index": 1, **CARE_SCHEMA}) + NOT_AVAILABLE_RULE
+    ),
+}
+BATCH_ITEM_TEMPLATES = {
+    "description": "Description {index}: {text}",
+    "care_instructions": "Care instructions {index}: {text}",
+}
+
+# Batch responses request the same attributes, so they share the template id
+TEMPLATE_IDS = {
+    field: hashlib.sha256(
+        (SYSTEM_PROMPTS[field] + PROMPT_TEMPLATES[field]).encode("utf-8")
+    ).hexdigest()[:12]
+    for field in FIELD_GROUPS
+}
 
 # ✅ Prompt builder
-def build_prompt(description, care_instructions):
+def build_prompt(field, text):
     """
-    Build a structured prompt for the Mistral AI model to extract product attributes.
+    Build a structured prompt for the Mistral AI model to extract one attribute group.
     
-    This function creates a detailed prompt that instructs the AI model to extract
-    specific product and care attributes from the provided description and care
-    instructions text. The prompt is designed to return structured JSON output.
+    Product attributes are extracted from the description and care attributes
+    from the care instructions in two separate requests, so each can be
+    cached on its own: many products reuse the same wash label with a
+    different description, and vice versa.
     
     Args:
-        description (str): Product description text containing details about the item.
-                          Should include information about design, materials, fit, etc.
-        care_instructions (str): Care and maintenance instructions for the product.
-                                Typically includes washing, drying, and storage guidelines.
+        field (str): Input field to extract from, "description" or
+                     "care_instructions".
+        text (str): Value of that field. Descriptions include information
+                    about design, materials, fit, etc.; care instructions
+                    typically include washing, drying, and storage guidelines.
+    
+    The static instructions live in ``SYSTEM_PROMPTS[field]`` and are sent as
+    the system message; this function only fills the slot of
+    ``PROMPT_TEMPLATES[field]``, which varies between products. Keeping the
+    invariant text first and identical across calls lets providers reuse
+    its prefix cache, and the fixed slot is what the structural cache
+    relies on.
     
     Returns:
-        str: A formatted prompt string that includes:
+        str: The user message holding the field's text.
+        ``SYSTEM_PROMPTS[field]`` carries:
             - Clear instructions for the AI model
-            - List of expected product attributes to extract
-            - List of expected care attributes to extract
-            - Input data (description and care instructions)
+            - Schema of the attributes to extract
             - Output format specification (JSON only)
     
-    Product Attributes Extracted:
+    Product Attributes Extracted (from "description"):
         - Product Type: Category/type of the product
         - Support/Wiring: Information about structural support elements
         - Closures: Types of fasteners, zippers, buttons, etc.
@@ -69,7 +365,7 @@ def build_prompt(description, care_instructions):
         - Intended Use / Function: Primary purpose or use case
         - Length: Size/length specifications
     
-    Care Attributes Extracted:
+    Care Attributes Extracted (from "care_instructions"):
         - Washing Instructions: How to clean the item
         - Drying Method: Recommended drying approach
         - Bleach Instructions: Bleach usage guidelines
@@ -77,45 +373,874 @@ def build_prompt(description, care_instructions):
         - Ironing Instructions: Ironing and pressing guidelines
     
     """
-    return f"""
-You are an expert product data annotator. Extract the following attributes from the product description and care instructions. Return them as a valid JSON object with these keys:
+    return PROMPT_TEMPLATES[field].format(text=text)
+
+# ✅ Batch prompt builder
+def build_batch_prompt(field, texts):
+    """
+    Build one prompt asking for an attribute group of several products.
 
-Product Attributes:
-- Product Type
-- Support/Wiring
-- Closures
-- Neckline design
-- Waist Style
-- Design Features
-- Intended Use / Function
-- Length
+    The instructions are sent once in ``BATCH_SYSTEM_PROMPTS[field]``; this
+    builds the user message listing the texts numbered from 1. The model is
+    asked for a JSON object whose "results" array holds one object per
+    text, each carrying its number in an "index" key (JSON mode only
+    allows an object at the top level).
 
-Care Attributes:
-- Washing Instructions
-- Drying Method
-- Bleach Instructions
-- Dry Cleaning
-- Ironing Instructions
+    Args:
+        field (str): Input field the texts come from.
+        texts (list[str]): Values of that field, one per product.
 
-Only include values that are mentioned or strongly implied. If something is missing, use "Not Available".
+    Returns:
+        str: The user message for the batch.
+    """
+    return "\n".join(
+        BATCH_ITEM_TEMPLATES[field].format(index=index, text=text)
+        for index, text in enumerate(texts, start=1)
+    )
 
-Product Description:
-\"\"\"{description}\"\"\"
 
-Care Instructions:
-\"\"\"{care_instructions}\"\"\"
+def parse_batch_output(items, count):
+    """
+    Match the objects of a batch response back to the texts sent.
 
-Only return valid JSON. No explanation.
-"""
+    Objects are placed by their "index" key when every number from 1 to
+    ``count`` appears exactly once, and by position otherwise.
+
+    Args:
+        items (object): Decoded JSON returned for a batch prompt.
+        count (int): Number of texts in the batch prompt.
+
+    Returns:
+        list[dict] | None: One attribute object per text, in prompt order,
+        or None if the response's "results" is not an array of ``count``
+        objects.
+    """
+    if isinstance(items, dict):
+        items = items.get("results")
+    if not isinstance(items, list) or len(items) != count:
+        return None
+    if not all(isinstance(item, dict) for item in items):
+        return None
+    by_index = {item.get("index"): item for item in items}
+    if set(by_index) == set(range(1, count + 1)):
+        return [by_index[index] for index in range(1, count + 1)]
+    return items
+
+# ✅ Error classification helpers
+def get_status_code(error):
+    """
+    Return the HTTP status code carried by an API exception, if any.
+
+    The Mistral client exposes ``status_code`` on its HTTP errors.
+
+    Args:
+        error (Exception): Exception raised while calling the API.
+
+    Returns:
+        int | None: The HTTP status code, or None for network-level failures
+        and other errors that never produced a response.
+    """
+    status_code = getattr(error, "status_code", None)
+    return status_code if isinstance(status_code, int) else None
+
+
+def is_retryable(error):
+    """
+    Decide whether a failed request is worth retrying.
+
+    Request timeouts (408), rate limiting (429), server errors (5xx) and
+    transport failures that never got a response (``httpx.TransportError``,
+    including timeouts, and ``NoResponseError``) are transient. Any other
+    4xx means the request itself is wrong and will fail again, and any other
+    exception is a bug on our side that a retry cannot fix.
+
+    Args:
+        error (Exception): Exception raised while calling the API.
+
+    Returns:
+        bool: True if the request should be retried after a backoff delay.
+    """
+    if isinstance(error, (httpx.TransportError, NoResponseError)):
+        return True
+    status_code = get_status_code(error)
+    return status_code is not None and (status_code in (408, 429) or status_code >= 500)
+
+
+def backoff_delay(attempt):
+    """
+    Compute the exponential backoff delay (with jitter) before a retry.
+
+    Args:
+        attempt (int): Zero-based index of the attempt that just failed.
+
+    Returns:
+        float: Seconds to wait, ``2 ** attempt`` plus up to 0.5s of random
+        jitter, capped at ``MAX_BACKOFF``.
+    """
+    return min(MAX_BACKOFF, 2 ** attempt + random.random() * 0.5)
+
+
+def get_retry_after(error):
+    """
+    Read the Retry-After header from a failed API response, if present.
+
+    Args:
+        error (Exception): Exception raised while calling the API.
+
+    Returns:
+        float | None: Seconds the server asked us to wait, or None if the
+        error carries no response or no usable Retry-After header.
+    """
+    response = getattr(error, "raw_response", None)
+    value = response.headers.get("retry-after") if response is not None else None
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, retry_at.timestamp() - time.time())
+
+# ✅ Returned by request_completion on a 401; no other model will succeed
+UNAUTHORIZED_ERROR = "Unauthorized. Check your API key."
+
+# ✅ Adaptive rate limiter
+class AdaptiveRateLimiter:
+    """
+    Token bucket whose refill rate adapts to the API's rate limiting.
+
+    Used as ``async with limiter:`` around each request. Entering also takes
+    one of ``max_concurrency`` request slots, held until the request returns,
+    so the requests in flight never exceed it however many batches and
+    fallbacks are running. The rate starts at
+    ``max_rate`` requests per second. Every 429 halves it (at most once per
+    ``RATE_ADJUST_INTERVAL``, so one burst of concurrent 429s counts as one
+    signal) down to ``min_rate``, and a Retry-After value pauses the bucket
+    for exactly that long. After ``RATE_ADJUST_INTERVAL`` seconds without a
+    429, successful requests raise the rate again additively, back up to
+    ``max_rate`` (AIMD).
+    """
+
+    def __init__(self, max_rate, max_concurrency=MAX_CONCURRENCY, min_rate=MIN_QPS):
+        self.max_rate = max_rate
+        self.min_rate = min(min_rate, max_rate)
+        self.current_rate_per_second = max_rate
+        self._tokens = 1.0
+        self._last_refill = time.monotonic()
+        self._last_adjustment = self._last_refill
+        self._last_decrease = float("-inf")
+        self._last_rate_limit = float("-inf")
+        self._blocked_until = 0.0
+        self._consecutive_rate_limits = 0
+        self._lock = asyncio.Lock()
+        self._slots = asyncio.Semaphore(max_concurrency)
+
+    async def __aenter__(self):
+        await self._slots.acquire()
+        try:
+            await self.acquire()
+        except BaseException:
+            self._slots.release()
+            raise
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self._slots.release()
+        return False
+
+    async def acquire(self):
+        """Wait until a request may be sent, then consume one token."""
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._blocked_until:
+                    await asyncio.sleep(self._blocked_until - now)
+                    continue
+                capacity = max(1.0, self.current_rate_per_second)
+                elapsed = now - self._last_refill
+                self._tokens = min(
+                    capacity, self._tokens + elapsed * self.current_rate_per_second
+                )
+                self._last_refill = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.current_rate_per_second)
+
+    def record_success(self):
+        """Count a successful request and grow the rate after a calm interval."""
+        self._consecutive_rate_limits = 0
+        now = time.monotonic()
+        if (
+            now - self._last_rate_limit >= RATE_ADJUST_INTERVAL
+            and now - self._last_adjustment >= RATE_ADJUST_INTERVAL
+            and self.current_rate_per_second < self.max_rate
+        ):
+            self.current_rate_per_second = min(
+                self.max_rate,
+                self.current_rate_per_second + RATE_INCREASE_STEP * self.max_rate,
+            )
+            self._last_adjustment = now
+
+    def record_rate_limit(self, retry_after=None):
+        """
+        Shrink the rate after a 429 and pause for the server's Retry-After.
+
+        Args:
+            retry_after (float, optional): Seconds from the Retry-After header.
+        """
+        self._consecutive_rate_limits += 1
+        now = time.monotonic()
+        if now - self._last_decrease >= RATE_ADJUST_INTERVAL:
+            self.current_rate_per_second = max(
+                self.min_rate, self.current_rate_per_second * RATE_DECREASE_FACTOR
+            )
+            self._last_decrease = now
+            self._last_adjustment = now
+        self._last_rate_limit = now
+        self._tokens = 0.0
+        self._last_refill = now
+        if retry_after:
+            self._blocked_until = max(self._blocked_until, now + retry_after)
+        if self._consecutive_rate_limits > 1:
+            logger.warning(
+                "%d rate limits in a row; sending %.2f requests/s",
+                self._consecutive_rate_limits, self.current_rate_per_second,
+            )
+
+# ✅ Cache key builder
+def canon(text):
+    """
+    Canonicalise text for use in cache keys.
+
+    HTML entities are decoded, the text is NFKC-normalised and lower-cased,
+    and runs of whitespace are collapsed, so variants that cannot change the
+    extracted attributes ("40&deg;" vs "40°", "Machine  wash" vs
+    "machine wash") share one key. The original text is still what goes
+    into the prompt.
+
+    Args:
+        text (str): Text as it appears in the input entry.
+
+    Returns:
+        str: The canonical form of ``text``.
+    """
+    text = unicodedata.normalize("NFKC", html.unescape(text))
+    return re.sub(r"\s+", " ", text.strip().lower())
+
+
+def get_cache_key(field, text):
+    """
+    Build the response cache key for one input field.
+
+    Requests are sent with temperature 0.0, so the same model cascade and
+    input text always produce the same attributes. The key is a SHA-256 digest over
+    those inputs, with the text canonicalised by ``canon``; product and care
+    attributes are cached under separate keys so a change to one field does
+    not invalidate the other.
+
+    Args:
+        field (str): Input field, "description" or "care_instructions".
+        text (str): Value of that field.
+
+    Returns:
+        str: Hex digest identifying the request.
+    """
+    payload = json.dumps(
+        {"models": MODELS, "field": field, "text": canon(text)}, sort_keys=True
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+# ✅ Structural cache
+def slot_skeleton(slot, text):
+    """
+    Normalise the value of a prompt slot into its structural skeleton.
+
+    Prompts for a field share one template and differ only in their slot,
+    so a response can be reused whenever a slot's skeleton was seen before.
+    Description skeletons are the canonical word sequence with colour
+    words masked, since colour is not one of the extracted attributes.
+    Care skeletons are the set of canonical care lines, since the same
+    wash label is often listed in a different order.
+
+    Args:
+        slot (str): Either "description" or "care_instructions".
+        text (str): Slot value as it appears in the input entry.
+
+    Returns:
+        list[str]: Skeleton tokens (description) or sorted lines (care).
+    """
+    if slot == "care_instructions":
+        lines = (canon(line) for line in text.splitlines())
+        return sorted({line for line in lines if line})
+    tokens = re.findall(r"[\w°%-]+", canon(text))
+    return ["<colour>" if token in COLOUR_WORDS else token for token in tokens]
+
+
+def get_slot_key(slot, text):
+    """
+    Build the structural cache key for one prompt slot.
+
+    Args:
+        slot (str): Either "description" or "care_instructions".
+        text (str): Slot value as it appears in the input entry.
+
+    Returns:
+        str: Hex digest over the models, template, slot name and skeleton.
+    """
+    payload = json.dumps(
+        [MODELS, TEMPLATE_IDS[slot], slot, slot_skeleton(slot, text)]
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def validate_attributes(field, extracted):
+    """
+    Validate the attributes of a field's group in a model response.
+
+    The model usually returns the attributes at the top level, but sometimes
+    nests them under the group name ("Product Attributes" or "Care
+    Attributes"); both are read. Keys outside the schema are dropped and
+    missing ones default to "Not Available", but values of the wrong type
+    (lists, numbers, null) are rejected.
+
+    Args:
+        field (str): Input field the response was extracted from.
+        extracted (object): Parsed JSON returned by the model.
+
+    Returns:
+        dict: Every attribute of the group, keyed by its display name.
+
+    Raises:
+        ValidationError: If the response does not match the group's schema.
+    """
+    values = extracted
+    if isinstance(extracted, dict):
+        nested = extracted.get(FIELD_GROUPS[field][0])
+        if isinstance(nested, dict):
+            values = {**extracted, **nested}
+    return ATTRIBUTE_MODELS[field].model_validate(values).model_dump(by_alias=True)
+
+
+def is_confident(attributes):
+    """
+    Check whether enough attributes were found to accept a response.
+
+    A small model that cannot read a text tends to answer "Not Available"
+    (or a blank, which ``AttributeGroup`` normalises to it) for most
+    attributes rather than produce invalid JSON, so the share of filled
+    attributes is used as its confidence.
+
+    Args:
+        attributes (dict): Output of ``validate_attributes``.
+
+    Returns:
+        bool: True if at least ``MIN_FILLED_FRACTION`` of the attributes
+        hold a value other than "Not Available".
+    """
+    filled = sum(value != "Not Available" for value in attributes.values())
+    return filled >= MIN_FILLED_FRACTION * len(attributes)
+
+
+def describe_validation_error(error):
+    """
+    Summarise a ValidationError in one line for logs and repair prompts.
+
+    Args:
+        error (ValidationError): Error raised by ``validate_attributes``.
+
+    Returns:
+        str: "field: message" pairs separated by semicolons.
+    """
+    return "; ".join(
+        f"{'.'.join(str(part) for part in item['loc']) or 'response'}: {item['msg']}"
+        for item in error.errors()
+    )
+
+# ✅ Semantic cache
+def lexical_signature(description):
+    """
+    Summarise the tokens that must match exactly for a semantic cache hit.
+
+    Embeddings put texts such as "padded bra" and "non-padded bra" or
+    "top" and "dress" very close together even though their attributes
+    differ. The signature pins down the parts of the description that
+    similarity alone cannot be trusted with: garment nouns, numbers and
+    "non-" qualifiers.
+
+    Args:
+        description (str): Product description text.
+
+    Returns:
+        tuple: Hashable signature; two entries may share a cached result
+        only if their signatures are equal.
+    """
+    tokens = re.findall(r"[\w-]+", description.lower())
+    nouns = frozenset(token for token in tokens if token in PRODUCT_NOUNS)
+    numbers = frozenset(token for token in tokens if token.isdigit())
+    negations = frozenset(token for token in tokens if token.startswith("non-"))
+    return nouns, numbers, negations
+
+
+class SemanticCache:
+    """
+    In-memory cache that returns product attributes extracted for similar descriptions.
+
+    Descriptions are embedded with a sentence-transformers model and stored
+    in a FAISS inner-product index (cosine similarity on normalised vectors).
+    A lookup returns the attributes of the most similar earlier entry whose
+    similarity exceeds the threshold and whose ``lexical_signature`` matches,
+    so colour or wording changes are reused while changes that affect the
+    extracted attributes still go to the API.
+
+    The index lives for a single run; results are persisted by the exact
+    response cache.
+    """
+
+    def __init__(self, model_name, threshold):
+        self.encoder = SentenceTransformer(model_name)
+        self.index = faiss.IndexFlatIP(
+            self.encoder.get_sentence_embedding_dimension()
+        )
+        self.threshold = threshold
+        self.entries = []  # (lexical signature, extracted attributes) per vector
+
+    def embed(self, description):
+        """
+        Embed a description as a normalised float32 row vector.
+
+        Args:
+            description (str): Product description text.
+
+        Returns:
+            numpy.ndarray: Array of shape (1, dimension).
+        """
+        return self.encoder.encode(
+            [description], normalize_embeddings=True
+        ).astype("float32")
+
+    def search(self, vector, signature):
+        """
+        Find cached attributes for an embedded description.
+
+        Args:
+            vector (numpy.ndarray): Output of ``embed``.
+            signature (tuple): Output of ``lexical_signature`` for the description.
+
+        Returns:
+            dict | None: Cached product attributes, or None when no neighbour is both
+            similar enough and lexically compatible.
+        """
+        if not self.entries:
+            return None
+        k = min(SEMANTIC_CANDIDATES, len(self.entries))
+        scores, ids = self.index.search(vector, k)
+        for score, idx in zip(scores[0], ids[0]):
+            if score < self.threshold:
+                break
+            cached_signature, extracted = self.entries[idx]
+            if cached_signature == signature:
+                return extracted
+        return None
+
+    def add(self, vector, signature, extracted):
+        """
+        Store the attributes extracted for an embedded description.
+
+        Args:
+            vector (numpy.ndarray): Output of ``embed``.
+            signature (tuple): Output of ``lexical_signature`` for the description.
+            extracted (dict): Product attributes returned by the model.
+        """
+        self.index.add(vector)
+        self.entries.append((signature, extracted))
+
+
+_semantic_cache = None
+_semantic_cache_loaded = False
+
+
+def get_semantic_cache():
+    """
+    Return the semantic cache, loading the embedding model on first use.
+
+    Returns:
+        SemanticCache | None: The cache, or None when it is disabled or its
+        optional dependencies are not installed.
+    """
+    global _semantic_cache, _semantic_cache_loaded
+    if not _semantic_cache_loaded:
+        _semantic_cache_loaded = True
+        if SEMANTIC_CACHE_ENABLED and SentenceTransformer is None:
+            logger.warning("Semantic cache disabled: install sentence-transformers and faiss-cpu.")
+        elif SEMANTIC_CACHE_ENABLED:
+            _semantic_cache = SemanticCache(SEMANTIC_MODEL, SEMANTIC_THRESHOLD)
+    return _semantic_cache
+
+
+async def close_resources():
+    """
+    Close the shared HTTP connection pool and the persistent cache.
+
+    Both are reopened on next use, so code importing this module can call
+    ``main`` or ``extract_entities`` again afterwards.
+    """
+    global _http_client, _client, _cache
+    if _http_client is not None:
+        await _http_client.aclose()
+    if _cache is not None:
+        _cache.close()
+    _http_client = _client = _cache = None
+
+# ✅ Cache lookup and storage
+async def lookup_cached(field, text):
+    """
+    Look one input field up in the exact, structural and semantic caches.
+
+    Blank fields are answered without a request: every attribute is
+    "Not Available".
+
+    Args:
+        field (str): Input field, "description" or "care_instructions".
+        text (str): Value of that field.
+
+    Returns:
+        tuple[dict | None, dict]: The cached attributes (or None on a miss)
+        and the lookup state needed by ``store_extracted`` to cache a fresh
+        response for this text.
+    """
+    if not text.strip():
+        return {name: "Not Available" for name in FIELD_GROUPS[field][1]}, {}
+
+    lookup = {
+        "cache_key": get_cache_key(field, text),
+        "slot_key": get_slot_key(field, text),
+    }
+    cache = get_cache()
+    if lookup["cache_key"] in cache:
+        return cache[lookup["cache_key"]], lookup
+    if lookup["slot_key"] in cache:
+        return cache[lookup["slot_key"]], lookup
+
+    semantic_cache = get_semantic_cache()
+    if semantic_cache is not None and field == "description":
+        lookup["signature"] = lexical_signature(text)
+        lookup["vector"] = await asyncio.to_thread(semantic_cache.embed, text)
+        extracted = semantic_cache.search(lookup["vector"], lookup["signature"])
+        if extracted is not None:
+            return extracted, lookup
+    return None, lookup
+
+
+def store_extracted(lookup, attributes):
+    """
+    Write validated attributes to every cache.
+
+    Args:
+        lookup (dict): Lookup state returned by ``lookup_cached``.
+        attributes (dict): Output of ``validate_attributes``.
+
+    Returns:
+        dict: ``attributes``, as written to the cache.
+    """
+    cache = get_cache()
+    cache[lookup["slot_key"]] = attributes
+    cache[lookup["cache_key"]] = attributes
+    if "vector" in lookup:
+        get_semantic_cache().add(lookup["vector"], lookup["signature"], attributes)
+    return attributes
+
+
+def parse_json(output):
+    """
+    Parse a model response as JSON.
+
+    Args:
+        output (str): Raw message content returned by the model.
+
+    Returns:
+        object | None: The decoded JSON value, or None if it is not valid JSON.
+    """
+    try:
+        return json.loads(output)
+    except json.JSONDecodeError:
+        return None
+
+# ✅ API call with retries
+async def request_completion(model, system_prompt, prompt, limiter):
+    """
+    Send a prompt to Mistral AI, retrying transient failures.
+
+    The invariant instructions go first as the system message and the
+    per-request text last as the user message, so every call shares the
+    longest possible identical prefix. JSON mode is requested, so the
+    model's output is constrained to a valid JSON object.
+
+    Args:
+        model (str): Name of the Mistral model to call.
+        system_prompt (str): Invariant instructions sent as the system message.
+        prompt (str): Per-request text sent as the user message.
+        limiter (AdaptiveRateLimiter): Rate limiter shared by all requests,
+                                       capped at ``MAX_QPS``.
+
+    Returns:
+        tuple[str | None, str | None]: The stripped message content and None
+        on success, or None and an error message on failure.
+
+    Retry Logic:
+        - Attempts up to ``MAX_ATTEMPTS`` API calls
+        - Reports each success and 429 to the limiter so it can adapt its rate
+        - Retries rate limiting (429) after the server's Retry-After delay when
+          given, and server (5xx), network and other 429 errors with
+          exponential backoff plus jitter
+        - Handles authentication errors (401) with immediate termination
+        - Aborts immediately on other client errors (4xx) and on exceptions
+          raised before a request was sent (e.g. ``TypeError``)
+    """
+    error_msg = ""
+    for attempt in range(MAX_ATTEMPTS):
+        try:
+            async with limiter:
+                response = await get_client().chat.complete_async(
+                    model=model,
+                    messages=[
+                        {"role": "system", "content": system_prompt},
+                        {"role": "user", "content": prompt},
+                    ],
+                    temperature=0.0,
+                    response_format={"type": "json_object"},
+                )
+            limiter.record_success()
+            return response.choices[0].message.content.strip(), None
+        except Exception as e:
+            error_msg = str(e)
+            logger.warning("Attempt %d failed: %s", attempt + 1, error_msg)
+            status_code = get_status_code(e)
+            if status_code == 401:
+                return None, UNAUTHORIZED_ERROR
+            if not is_retryable(e):
+                return None, f"API error: {error_msg}"
+            retry_after = None
+            if status_code == 429:
+                retry_after = get_retry_after(e)
+                limiter.record_rate_limit(retry_after)
+            if attempt + 1 < MAX_ATTEMPTS:
+                delay = retry_after if retry_after is not None else backoff_delay(attempt)
+                await asyncio.sleep(delay)
+    return None, f"All attempts failed: {error_msg}"
+
+# ✅ Per-field extraction
+async def request_validated(model, field, text, limiter):
+    """
+    Request the attributes of one field from one model and validate them.
+
+    A response that is not valid JSON or fails ``validate_attributes`` is
+    requested again with the problem appended to the prompt, so the model
+    can repair its output.
+
+    Args:
+        model (str): Name of the Mistral model to call.
+        field (str): Input field, "description" or "care_instructions".
+        text (str): Value of that field.
+        limiter (AdaptiveRateLimiter): Rate limiter shared by all requests,
+                                       capped at ``MAX_QPS``.
+
+    Returns:
+        tuple[dict | None, str | None, str | None]: The validated attributes
+        (or None), the last raw output and an API error message (or None).
+    """
+    prompt = build_prompt(field, text)
+    output = None
+    for attempt in range(MAX_PARSE_ATTEMPTS):
+        output, error = await request_completion(model, SYSTEM_PROMPTS[field], prompt, limiter)
+        if error is not None:
+            return None, output, error
+        extracted = parse_json(output)
+        try:
+            if extracted is None:
+                problem = "the response is not valid JSON"
+            else:
+                return validate_attributes(field, extracted), output, None
+        except ValidationError as e:
+            problem = describe_validation_error(e)
+        logger.warning("%s validation attempt %d failed: %s", model, attempt + 1, problem)
+        prompt = build_prompt(field, text) + REPAIR_TEMPLATE.format(problem=problem)
+    return None, output, None
+
+
+async def extract_field(field, text, limiter, lookup=None, models=None, fallback=None):
+    """
+    Extract the attribute group of one input field of one product.
+
+    The models of the cascade are tried in order. A model's answer is
+    accepted when it passes validation and ``is_confident``; otherwise, or
+    when its request fails (except with a 401), the text is escalated to
+    the next model. If no answer is confident, the last valid one is kept.
+    It is cached only when every model of the cascade answered, so a text
+    whose escalation failed is escalated again by a later run. An error is
+    returned only when no model produced a valid answer.
+
+    Args:
+        field (str): Input field, "description" or "care_instructions".
+        text (str): Value of that field.
+        limiter (AdaptiveRateLimiter): Rate limiter shared by all requests,
+                                       capped at ``MAX_QPS``.
+        lookup (dict, optional): Lookup state from an earlier cache miss.
+                                 When given, the caches are not consulted
+                                 again and the API is called directly.
+        models (list[str], optional): Cascade to try, defaults to ``MODELS``.
+        fallback (dict, optional): Valid but not confident attributes from
+                                   an earlier model, kept if no model in
+                                   ``models`` does better.
+
+    Returns:
+        dict: ``{group: attributes}`` on success, otherwise
+        ``{"raw_output": ...}`` or ``{"error": ...}``.
+    """
+    group = FIELD_GROUPS[field][0]
+    if lookup is None:
+        cached, lookup = await lookup_cached(field, text)
+        if cached is not None:
+            return {group: cached}
+
+    models = models or MODELS
+    attributes = fallback
+    for model in models:
+        candidate, output, error = await request_validated(model, field, text, limiter)
+        if candidate is not None:
+            attributes = candidate
+            if is_confident(candidate):
+                break
+        if error == UNAUTHORIZED_ERROR:
+            break
+        if model != models[-1]:
+            if error is not None:
+                reason = error
+            elif candidate is None:
+                reason = "no valid response"
+            else:
+                reason = "too few attributes found"
+            logger.warning("Escalating %s from %s: %s", field, model, reason)
+    if attributes is None:
+        return {"error": error} if error is not None else {"raw_output": output}
+    if error is not None:
+        return {group: attributes}
+    return {group: store_extracted(lookup, attributes)}
+
+
+async def extract_field_batch(field, texts, limiter):
+    """
+    Extract the attribute group of one input field for several products.
+
+    Texts answered by the caches are returned directly and repeated texts
+    are requested once. The remaining texts are packed into one prompt built
+    by ``build_batch_prompt``, so the instructions and the request
+    round-trip are paid once per batch instead of once per product. The
+    batch goes to the first model of the cascade. If its reply does not
+    hold exactly one object per text, each of those texts falls back to
+    ``extract_field``; a single item that fails validation or
+    ``is_confident`` is escalated to the rest of the cascade (keeping its
+    valid answer as the fallback), and so is every text when the batch
+    request fails (except with a 401).
+
+    Args:
+        field (str): Input field, "description" or "care_instructions".
+        texts (list[str]): Values of that field, one per product.
+        limiter (AdaptiveRateLimiter): Rate limiter shared by all requests,
+                                       capped at ``MAX_QPS``.
+
+    Returns:
+        list[dict]: One ``extract_field`` result per text, in order.
+    """
+    group = FIELD_GROUPS[field][0]
+    unique = list(dict.fromkeys(texts))
+    lookups = await asyncio.gather(*(lookup_cached(field, text) for text in unique))
+    outcomes = {
+        text: {group: cached}
+        for text, (cached, _) in zip(unique, lookups)
+        if cached is not None
+    }
+    pending = [
+        (text, lookup) for text, (cached, lookup) in zip(unique, lookups)
+        if cached is None
+    ]
+
+    if len(pending) == 1:
+        text, lookup = pending[0]
+        outcomes[text] = await extract_field(field, text, limiter, lookup)
+    elif pending:
+        prompt = build_batch_prompt(field, [text for text, _ in pending])
+        output, error = await request_completion(
+            MODELS[0], BATCH_SYSTEM_PROMPTS[field], prompt, limiter
+        )
+        escalation = MODELS[1:] or MODELS
+        if error is not None and (error == UNAUTHORIZED_ERROR or len(MODELS) == 1):
+            for text, _ in pending:
+                outcomes[text] = {"error": error}
+            return [outcomes[text] for text in texts]
+
+        items = None
+        if error is None:
+            items = parse_batch_output(parse_json(output), len(pending))
+        if error is not None:
+            logger.warning("Escalating %s batch from %s: %s", field, MODELS[0], error)
+            retry = [(text, lookup, escalation, None) for text, lookup in pending]
+        elif items is None:
+            logger.warning("Batch response did not match %d texts; retrying individually.", len(pending))
+            retry = [(text, lookup, MODELS, None) for text, lookup in pending]
+        else:
+            retry = []
+            for (text, lookup), item in zip(pending, items):
+                try:
+                    attributes = validate_attributes(field, item)
+                except ValidationError as e:
+                    logger.warning("Batch item failed validation: %s", describe_validation_error(e))
+                    retry.append((text, lookup, escalation, None))
+                    continue
+                if len(MODELS) > 1 and not is_confident(attributes):
+                    logger.warning("Escalating %s from %s: too few attributes found", field, MODELS[0])
+                    retry.append((text, lookup, escalation, attributes))
+                    continue
+                outcomes[text] = {group: store_extracted(lookup, attributes)}
+        retried = await asyncio.gather(*(
+            extract_field(field, text, limiter, lookup, models, fallback)
+            for text, lookup, models, fallback in retry
+        ))
+        outcomes.update(zip((text for text, *_ in retry), retried))
+    return [outcomes[text] for text in texts]
+
+
+def merge_outcomes(entry, outcomes):
+    """
+    Merge the per-field extraction results of one product into its entry.
+
+    Args:
+        entry (dict): Product entry from the input file.
+        outcomes (list[dict]): ``extract_field`` results for the entry.
+
+    Returns:
+        dict: The entry with every extracted attribute group; if a field
+        failed, its ``error`` or ``raw_output`` is added (the first one
+        wins when both fields failed).
+    """
+    result = dict(entry)
+    for outcome in outcomes:
+        for key, value in outcome.items():
+            result.setdefault(key, value)
+    return result
 
 # ✅ Extraction function
-def extract_entities(entry):
+async def extract_entities(entry, limiter):
     """
     Extract product and care attributes from a single product entry using Mistral AI.
     
     This function processes a single product entry containing description and care
-    instructions, sends it to the Mistral AI API for attribute extraction, and
-    returns the original entry enhanced with extracted attributes.
+    instructions, sends each field to the Mistral AI API for attribute extraction
+    (concurrently, in two small requests), and returns the original entry enhanced
+    with extracted attributes.
     
     The function includes robust error handling and retry logic to handle various
     API failure scenarios including rate limiting, authentication errors, and
@@ -126,66 +1251,282 @@ def extract_entities(entry):
                      - description (str): Product description text
                      - care_instructions (str): Care instruction text
                      - Additional fields are preserved in the output
+        limiter (AdaptiveRateLimiter): Rate limiter shared by all entries,
+                                       capped at ``MAX_QPS``.
     
     Returns:
         dict: Enhanced dictionary containing:
             - All original fields from the input entry
-            - Extracted attributes as individual key-value pairs (on success)
+            - "Product Attributes" and "Care Attributes" dicts (on success)
             - OR raw_output (str): Raw API response if JSON parsing fails
             - OR error (str): Error message if API calls fail
     
-    Retry Logic:
-        - Attempts up to 3 API calls per entry
-        - Handles rate limiting (429 errors) with 5-second delays
-        - Handles authentication errors (401) with immediate termination
-        - Handles other API errors with appropriate error messages
+    Caching (per field, so a shared wash label is reused across products):
+        - Texts already extracted are answered from the persistent cache
+          without calling the API
+        - Otherwise, a text whose skeleton matches an earlier one reuses
+          its cached attributes
+        - Otherwise, when the semantic cache is enabled, a near-duplicate
+          description with a matching lexical signature is reused
+        - Only successfully parsed responses are written to the caches
     
     Error Handling:
-        - JSON parsing errors: Returns raw output for manual inspection
-        - Rate limiting: Implements exponential backoff
+        - JSON parsing or schema validation errors: Requested again once with
+          the problem described, then the raw output is returned for manual
+          inspection
+        - Transient errors: Retried until attempts are exhausted
         - Authentication errors: Provides clear error message
-        - Network/API errors: Captures and returns error details
-        - All attempts failed: Returns failure message
+        - Non-retryable API errors: Captures and returns error details
+        - All attempts failed: Returns failure message with the last error
     
     API Configuration:
-        - Model: open-mistral-7b
+        - Models: ``MODELS`` cascade (ministral-3b-latest, then open-mistral-7b)
         - Temperature: 0.0 (deterministic output)
         - Max attempts: 3
-        - Rate limit delay: 5 seconds
+        - Backoff delay: min(32, 2 ** attempt + jitter) seconds
     """
-    description = entry.get("description", "")
-    care_instructions = entry.get("care_instructions", "")
-    prompt = build_prompt(description, care_instructions)
+    outcomes = await asyncio.gather(*(
+        extract_field(field, entry.get(field, ""), limiter) for field in FIELD_GROUPS
+    ))
+    return merge_outcomes(entry, outcomes)
 
-    for attempt in range(3):
-        try:
-            response = client.chat.complete(
-                model="open-mistral-7b",
-                messages=[{"role": "user", "content": prompt}],
-                temperature=0.0,
-            )
-            output = response.choices[0].message.content.strip()
+# ✅ Batched extraction function
+async def extract_entities_batch(batch, limiter):
+    """
+    Extract attributes for several product entries with one API call per field.
+
+    The descriptions of the batch go out in one request and the care
+    instructions in another, concurrently; see ``extract_field_batch``.
+
+    Args:
+        batch (list[dict]): Product entries, as accepted by ``extract_entities``.
+        limiter (AdaptiveRateLimiter): Rate limiter shared by all requests,
+                                       capped at ``MAX_QPS``.
+
+    Returns:
+        list[dict]: One output dictionary per entry, in the order of ``batch``.
+    """
+    per_field = await asyncio.gather(*(
+        extract_field_batch(field, [entry.get(field, "") for entry in batch], limiter)
+        for field in FIELD_GROUPS
+    ))
+    return [
+        merge_outcomes(entry, outcomes)
+        for entry, outcomes in zip(batch, zip(*per_field))
+    ]
+
+# ✅ Resume support
+RESULT_KEYS = {group for group, _ in FIELD_GROUPS.values()} | {"error", "raw_output"}
+
+
+def get_entry_id(entry):
+    """
+    Identify an input entry across runs.
+
+    Args:
+        entry (dict): Product entry from the input file (or its output line,
+                      which keeps every input field).
+
+    Returns:
+        str: The entry's ``article_no``, or when it has none a SHA-256 digest
+        of its input fields (``RESULT_KEYS`` added by extraction are ignored,
+        so an output line has the same id as its input entry).
+    """
+    if entry.get("article_no"):
+        return str(entry["article_no"])
+    fields = {key: value for key, value in entry.items() if key not in RESULT_KEYS}
+    payload = json.dumps(fields, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def load_completed_ids(path):
+    """
+    Collect the ids of entries already written to a JSONL output file.
+
+    Lines recording an ``error`` or an unvalidated ``raw_output`` do not
+    count as completed, so failed entries are retried on the next run; a
+    truncated last line from an interrupted run is ignored.
+
+    Args:
+        path (str): Path of the JSONL output file.
+
+    Returns:
+        set[str]: Ids (see ``get_entry_id``) of completed entries.
+    """
+    completed = set()
+    if not os.path.exists(path):
+        return completed
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
             try:
-                extracted = json.loads(output)
-                return {**entry, **extracted}
+                result = json.loads(line)
             except json.JSONDecodeError:
-                return {**entry, "raw_output": output}
-        except Exception as e:
-            error_msg = str(e)
-            print(f"⚠️ Attempt {attempt + 1} failed: {error_msg}")
-            if "429" in error_msg:
-                time.sleep(5)
-            elif "401" in error_msg:
-                return {**entry, "error": "Unauthorized. Check your API key."}
-            else:
-                return {**entry, "error": f"API error: {error_msg}"}
-    return {**entry, "error": "All attempts failed"}
+                continue
+            if "error" not in result and "raw_output" not in result:
+                completed.add(get_entry_id(result))
+    return completed
+
+# ✅ Input deduplication
+def get_dedupe_key(entry):
+    """
+    Key entries whose extraction requests would be identical.
+
+    Args:
+        entry (dict): Product entry from the input file.
+
+    Returns:
+        tuple[str, str]: Canonical description and care instructions.
+    """
+    return (
+        canon(entry.get("description", "")),
+        canon(entry.get("care_instructions", "")),
+    )
+
+
+def group_duplicates(entries):
+    """
+    Group entries that share a description and care instructions.
 
-# ✅ Run on all items
-output_data = [extract_entities(entry) for entry in input_data]
+    Args:
+        entries (list[dict]): Product entries, in input order.
+
+    Returns:
+        dict[tuple, list[dict]]: Entries per ``get_dedupe_key``, in order of
+        first appearance; the first entry of each group is sent to the API.
+    """
+    groups = {}
+    for entry in entries:
+        groups.setdefault(get_dedupe_key(entry), []).append(entry)
+    return groups
+
+# ✅ Flattened CSV export
+def flatten_record(record, prefix=""):
+    """
+    Flatten nested dicts into dotted column names.
+
+    ``{"Care Attributes": {"Drying Method": "Line dry"}}`` becomes
+    ``{"Care Attributes.Drying Method": "Line dry"}``. Lists and other
+    non-scalar values are stored as JSON text rather than Python reprs.
+
+    Args:
+        record (dict): One result read from the JSONL output.
+        prefix (str): Column name prefix of the enclosing dict.
+
+    Returns:
+        dict: Column name to cell value.
+    """
+    flat = {}
+    for key, value in record.items():
+        column = f"{prefix}{key}"
+        if isinstance(value, dict):
+            flat.update(flatten_record(value, f"{column}."))
+        elif isinstance(value, list):
+            flat[column] = json.dumps(value, ensure_ascii=False)
+        else:
+            flat[column] = value
+    return flat
+
+
+def export_csv(jsonl_path, csv_path):
+    """
+    Write a flattened CSV copy of a JSONL output file.
+
+    An entry written more than once (an error retried by a resumed run)
+    keeps its latest line. Columns appear in order of first appearance and
+    cells missing from a row are left empty.
+
+    Args:
+        jsonl_path (str): Path of the JSONL output file.
+        csv_path (str): Path of the CSV file to (over)write.
+
+    Returns:
+        int: Number of rows written.
+    """
+    rows = {}
+    with open(jsonl_path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            rows.pop(get_entry_id(record), None)
+            rows[get_entry_id(record)] = flatten_record(record)
+    columns = list(dict.fromkeys(column for row in rows.values() for column in row))
+    with open(csv_path, "w", encoding="utf-8", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=columns)
+        writer.writeheader()
+        writer.writerows(rows.values())
+    return len(rows)
+
+# ✅ Run on all items concurrently
+async def main():
+    """
+    Run attribute extraction over every entry of ``INPUT_PATH`` concurrently.
+
+    Rows with the same description and care instructions are extracted
+    once and the result is fanned out to each of them. The unique entries
+    are grouped into batches of ``BATCH_SIZE`` and all batches are
+    scheduled at once. The shared limiter caps API requests in flight at
+    ``MAX_CONCURRENCY`` and paces them to at most ``MAX_QPS`` per second.
+    A separate semaphore admits at most ``MAX_CONCURRENCY`` batches at a
+    time; a batch holds its slot from the cache lookup onwards, so batches
+    waiting for a slot can reuse results stored by earlier ones.
+
+    Results are appended to ``OUTPUT_PATH`` one JSON line per entry as each
+    batch completes, so memory stays flat and an interrupted run loses at
+    most the batches in flight. Entries already written by a previous run
+    are skipped. Entries of a batch whose task raised are written with an
+    ``error`` field instead of aborting the whole run. A progress bar
+    reports completed batches, their rate and the ETA, with log records
+    printed above it. The shared HTTP connection pool and the persistent
+    cache are closed (see ``close_resources``) once all batches are done.
+
+    Returns:
+        int: Number of entries written by this run.
+    """
+    with open(INPUT_PATH, "r", encoding="utf-8") as f:
+        input_data = json.load(f)
+    completed = load_completed_ids(OUTPUT_PATH)
+    pending = [entry for entry in input_data if get_entry_id(entry) not in completed]
+    if completed:
+        print(f"↩️ Resuming: skipping {len(input_data) - len(pending)} entries already in '{OUTPUT_PATH}'")
+    groups = group_duplicates(pending)
+    unique = [rows[0] for rows in groups.values()]
+    if len(unique) < len(pending):
+        print(f"🔁 {len(pending) - len(unique)} duplicate entries will reuse the result of an identical entry")
+
+    semaphore = asyncio.Semaphore(MAX_CONCURRENCY)
+    limiter = AdaptiveRateLimiter(MAX_QPS, MAX_CONCURRENCY)
+
+    async def run_batch(batch):
+        async with semaphore:
+            try:
+                return batch, await extract_entities_batch(batch, limiter)
+            except Exception as e:
+                return batch, [{**entry, "error": f"Unexpected error: {e}"} for entry in batch]
 
-# ✅ Save to JSON output
-with open("hm_output2.json", "w", encoding="utf-8") as f:
-    json.dump(output_data, f, ensure_ascii=False, indent=2)
+    batches = [unique[i:i + BATCH_SIZE] for i in range(0, len(unique), BATCH_SIZE)]
+    written = 0
+    try:
+        with open(OUTPUT_PATH, "a", encoding="utf-8") as f, logging_redirect_tqdm():
+            tasks = [run_batch(b) for b in batches]
+            for next_batch in atqdm.as_completed(tasks, total=len(tasks), desc="Extracting", unit="batch"):
+                batch, results = await next_batch
+                for entry, result in zip(batch, results):
+                    extracted = {k: v for k, v in result.items() if k not in entry}
+                    for row in groups[get_dedupe_key(entry)]:
+                        f.write(json.dumps({**row, **extracted}, ensure_ascii=False) + "\n")
+                        written += 1
+                f.flush()
+    finally:
+        await close_resources()
+    return written
 
-print("✅ Extraction complete. Results saved to 'hm_output.json'")
+if __name__ == "__main__":
+    if not api_key:
+        raise SystemExit("❌ MISTRAL_API_KEY is not set. Add it to the environment or a .env file.")
+    logging.basicConfig(level=logging.WARNING, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    written = asyncio.run(main())
+    print(f"✅ Extraction complete. {written} results saved to '{OUTPUT_PATH}'")
+    exported = export_csv(OUTPUT_PATH, CSV_OUTPUT_PATH)
+    print(f"📄 {exported} rows exported to '{CSV_OUTPUT_PATH}'")